@@ -8,23 +8,74 @@ Cách hoạt động:
 2. Lấy extension_server_port và csrf_token từ command line
 3. Tìm port đang listen
 4. Gọi API GetUserStatus qua HTTPS để lấy quota
+
+Các lệnh offline (history, log) chỉ đọc file local nên các module mạng
+và tìm process (subprocess, ssl, urllib.request, re) được import lazy
+bên trong hàm cần dùng.
 """
 
-import subprocess
 import json
-import re
-import ssl
-import urllib.request
 import sys
 from datetime import datetime, timedelta
 
 
+# ============================================================
+#  Đồng hồ — thật hoặc ảo (cho replay mode)
+# ============================================================
+
+class SystemClock:
+    """Đồng hồ thật: datetime.now() + time.sleep()."""
+
+    def now(self):
+        return datetime.now()
+
+    def utcnow(self):
+        return datetime.utcnow()
+
+    def sleep(self, seconds):
+        import time
+        time.sleep(seconds)
+
+
+class VirtualClock:
+    """Đồng hồ ảo: sleep() chỉ tăng thời gian, không chờ thật.
+
+    Có timeline (iterator datetime) thì mỗi sleep() nhảy tới mốc kế tiếp
+    thay vì cộng `seconds`; hết timeline thì đồng hồ đứng yên.
+    """
+
+    def __init__(self, start=None, timeline=None):
+        self._now = start or datetime.now()
+        self._utc_offset = datetime.now() - datetime.utcnow()
+        self._timeline = timeline
+
+    def now(self):
+        return self._now
+
+    def utcnow(self):
+        return self._now - self._utc_offset
+
+    def sleep(self, seconds):
+        if self._timeline is None:
+            self._now += timedelta(seconds=seconds)
+            return
+        nxt = next(self._timeline, None)
+        if nxt is not None:
+            self._now = max(self._now, nxt)
+
+
+_clock = SystemClock()
+
+
 # ============================================================
 #  PHẦN 1: Tìm process Antigravity
 # ============================================================
 
 def find_antigravity_processes():
     """Tìm tất cả process language_server có csrf_token (= Antigravity)."""
+    import re
+    import subprocess
+
     cmd = (
         'chcp 65001 >nul && powershell -NoProfile -Command "'
         '[Console]::OutputEncoding = [System.Text.Encoding]::UTF8; '
@@ -87,6 +138,8 @@ def find_antigravity_processes():
 
 def get_listening_ports(pid):
     """Lấy danh sách port đang listen của 1 PID."""
+    import subprocess
+
     cmd = (
         f'chcp 65001 >nul && powershell -NoProfile -NonInteractive -Command "'
         f'[Console]::OutputEncoding = [System.Text.Encoding]::UTF8; '
@@ -117,6 +170,9 @@ def get_listening_ports(pid):
 
 def call_api(port, path, csrf_token, body=None):
     """Gọi HTTPS POST đến localhost Antigravity server."""
+    import ssl
+    import urllib.request
+
     if body is None:
         body = {}
 
@@ -192,7 +248,7 @@ def format_time_remaining(reset_time_str):
         else:
             return reset_time_str
 
-        now = datetime.utcnow()
+        now = _clock.utcnow()
         diff = reset_time - now
         if diff.total_seconds() <= 0:
             return "Đang reset..."
@@ -260,22 +316,23 @@ def extract_user_info(data):
     }
 
 
-def display_quota(data):
+def display_quota(data, save_raw=True):
     """Hiển thị quota đẹp từ dữ liệu API."""
     if not data:
         print("[ERROR] Không nhận được dữ liệu quota!")
         return
 
     # Lưu raw data
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H%M%S")
-    raw_file = f"quota_raw_{timestamp}.json"
-    with open(raw_file, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-    print(f"\n📁 Dữ liệu thô: {raw_file}")
+    if save_raw:
+        timestamp = _clock.now().strftime("%Y-%m-%d_%H%M%S")
+        raw_file = f"quota_raw_{timestamp}.json"
+        with open(raw_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        print(f"\n📁 Dữ liệu thô: {raw_file}")
 
     print("\n" + "=" * 70)
     print("🚀 ANTIGRAVITY QUOTA STATUS")
-    print(f"📅 Thời gian: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"📅 Thời gian: {_clock.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("=" * 70)
 
     # User info
@@ -342,6 +399,7 @@ def display_quota(data):
 # ============================================================
 
 HISTORY_FILE = "quota_history.json"
+MAX_HISTORY_ENTRIES = 2000
 
 
 def load_history():
@@ -353,20 +411,6 @@ def load_history():
         return []
 
 
-def _build_snapshot(data):
-    """Tạo snapshot từ API data để so sánh."""
-    models = extract_models(data)
-    user = extract_user_info(data)
-    return {
-        "prompt_credits": user["prompt_credits"],
-        "flow_credits": user["flow_credits"],
-        "models": {
-            m["label"]: m["remaining_fraction"]
-            for m in models
-        },
-    }
-
-
 def _compute_deltas(prev_entry, curr_snapshot):
     """So sánh snapshot hiện tại với entry trước, trả về dict deltas."""
     deltas = {}
@@ -401,30 +445,12 @@ def _compute_deltas(prev_entry, curr_snapshot):
     return deltas
 
 
-def _has_changes(prev_entry, curr_snapshot):
-    """Kiểm tra xem quota có thay đổi so với lần trước không."""
-    return len(_compute_deltas(prev_entry, curr_snapshot)) > 0
-
-
-def save_to_history(data, force=False):
-    """Lưu snapshot quota — chỉ lưu khi có thay đổi (hoặc force=True)."""
-    history = load_history()
-
+def _build_entry(data, timestamp):
+    """Tạo history entry (chưa có deltas) từ API data."""
     models = extract_models(data)
     user = extract_user_info(data)
-    curr_snapshot = _build_snapshot(data)
-
-    # So sánh với entry trước
-    deltas = {}
-    if history and not force:
-        prev = history[-1]
-        if not _has_changes(prev, curr_snapshot):
-            print("  ⏸️  Quota không thay đổi, bỏ qua.")
-            return False
-        deltas = _compute_deltas(prev, curr_snapshot)
-
-    entry = {
-        "timestamp": datetime.now().isoformat(),
+    return {
+        "timestamp": timestamp,
         "user": user["email"],
         "plan": user["plan"],
         "prompt_credits": user["prompt_credits"],
@@ -439,19 +465,78 @@ def save_to_history(data, force=False):
         ],
     }
 
+
+def _entry_snapshot(entry):
+    """Chuyển history entry về dạng snapshot để so sánh với entry trước."""
+    return {
+        "prompt_credits": entry.get("prompt_credits"),
+        "flow_credits": entry.get("flow_credits"),
+        "models": {
+            m.get("label", "?"): m.get("remaining")
+            for m in entry.get("models", [])
+        },
+    }
+
+
+def _snapshot_digest(snapshot):
+    """Digest các field được theo dõi (credits + % từng model).
+
+    Là tuple bất biến nên so sánh == rẻ và không bị collision như hash.
+    """
+    return (
+        snapshot["prompt_credits"],
+        snapshot["flow_credits"],
+        tuple(sorted(snapshot["models"].items(), key=lambda kv: kv[0])),
+    )
+
+
+def save_to_history(data, force=False, entry=None):
+    """Lưu snapshot quota — chỉ lưu khi có thay đổi (hoặc force=True).
+
+    entry: entry đã build sẵn từ data (monitor_loop) để không extract lại.
+    """
+    history = load_history()
+
+    if entry is None:
+        entry = _build_entry(data, None)
+    curr_snapshot = _entry_snapshot(entry)
+
+    # So sánh với entry trước (force chỉ bỏ qua việc dừng khi không đổi,
+    # deltas vẫn được tính để alert thấy thay đổi giữa 2 lần chạy)
+    deltas = {}
+    if history:
+        deltas = _compute_deltas(history[-1], curr_snapshot)
+        if not deltas and not force:
+            print("  ⏸️  Quota không thay đổi, bỏ qua.")
+            return False
+
+    entry["timestamp"] = _clock.now().isoformat()
+
     if deltas:
         entry["deltas"] = deltas
 
     history.append(entry)
 
-    # Giữ tối đa 2000 entries
-    max_entries = 2000
-    if len(history) > max_entries:
-        history = history[-max_entries:]
+    # Giữ tối đa MAX_HISTORY_ENTRIES entries
+    trimmed = max(0, len(history) - MAX_HISTORY_ENTRIES)
+    if trimmed:
+        history = history[-MAX_HISTORY_ENTRIES:]
 
+    cache_current = _change_log.is_current()
     with open(HISTORY_FILE, "w", encoding="utf-8") as f:
         json.dump(history, f, indent=2, ensure_ascii=False)
 
+    # Cập nhật change log cache tăng dần (chỉ khi cache khớp file trước khi ghi)
+    if cache_current:
+        prev = history[-2] if len(history) > 1 else None
+        _change_log.append(prev, entry, len(history), trimmed)
+    else:
+        _change_log.invalidate()
+
+    engine = get_alert_engine()
+    if engine:
+        engine.evaluate(curr_snapshot, deltas)
+
     # Hiển thị delta ngay
     if deltas:
         print(f"\n  � THAY ĐỔI SO VỚI LẦN TRƯỚC:")
@@ -551,109 +636,521 @@ def show_history(n=20):
 #  PHẦN 5: Change Log — Lịch sử thay đổi từng model
 # ============================================================
 
+def _entry_changes(prev, curr, seq):
+    """Changes giữa 2 entry liền nhau → (credit_changes, {label: change}).
+
+    seq là chỉ số tuyệt đối của curr, dùng để bỏ change khi history bị cắt.
+    """
+    ts = curr.get("timestamp", "?")
+    try:
+        dt = datetime.fromisoformat(ts)
+        ts_display = dt.strftime("%m/%d %H:%M:%S")
+    except:
+        ts_display = ts[:19]
+
+    # Credits changes
+    credit_changes = []
+    for key, emoji, label in [
+        ("prompt_credits", "💳", "Prompt Credits"),
+        ("flow_credits", "🌊", "Flow Credits"),
+    ]:
+        prev_val = prev.get(key)
+        curr_val = curr.get(key)
+        if isinstance(prev_val, (int, float)) and isinstance(curr_val, (int, float)):
+            diff = curr_val - prev_val
+            if diff != 0:
+                credit_changes.append({
+                    "seq": seq,
+                    "ts": ts_display,
+                    "type": label,
+                    "emoji": emoji,
+                    "before": prev_val,
+                    "after": curr_val,
+                    "delta": diff,
+                })
+
+    # Model changes
+    prev_models = {}
+    for m in prev.get("models", []):
+        prev_models[m["label"]] = m.get("remaining")
+
+    model_changes = {}
+    for m in curr.get("models", []):
+        label = m.get("label", "?")
+        curr_frac = m.get("remaining")
+        prev_frac = prev_models.get(label)
+
+        if prev_frac is not None and curr_frac is not None:
+            diff = round((curr_frac - prev_frac) * 100, 1)
+            if diff != 0:
+                model_changes[label] = {
+                    "seq": seq,
+                    "ts": ts_display,
+                    "before": round(prev_frac * 100, 1),
+                    "after": round(curr_frac * 100, 1),
+                    "delta": diff,
+                }
+
+    return credit_changes, model_changes
+
+
+def _history_stat():
+    """(path, mtime, size) của HISTORY_FILE — phát hiện file bị ghi từ ngoài."""
+    import os
+
+    try:
+        st = os.stat(HISTORY_FILE)
+    except OSError:
+        return (HISTORY_FILE, None, None)
+    return (HISTORY_FILE, st.st_mtime_ns, st.st_size)
+
+
+class ChangeLogCache:
+    """Cache change log: cập nhật tăng dần + cache text từng section.
+
+    Mỗi lần save_to_history ghi entry mới thì version tăng; chỉ model nào
+    có change ở entry đó (hoặc bị cắt khỏi history) mới được render lại,
+    các section khác dùng lại text cũ theo key (label, n).
+    Nếu HISTORY_FILE bị thay đổi từ ngoài (stat khác) thì build lại từ đầu.
+    """
+
+    def __init__(self):
+        self.stat = None
+        self.version = 0
+        self.entry_count = 0
+        self.first_seq = 0
+        self.credit_changes = []
+        self.model_changes = {}   # {label: [change]}
+        self.label_versions = {}  # {label: version lần đổi cuối}
+        self.credit_version = 0
+        self._sections = {}       # {(label, n): (version, text)}
+
+    def is_current(self):
+        return self.stat is not None and self.stat == _history_stat()
+
+    def invalidate(self):
+        self.stat = None
+
+    def rebuild(self, history):
+        self.version += 1
+        self.entry_count = len(history)
+        self.first_seq = 0
+        self.credit_changes = []
+        self.model_changes = {}
+        self.label_versions = {}
+        self.credit_version = self.version
+        self._sections = {}
+        for i in range(1, len(history)):
+            credits, models = _entry_changes(history[i - 1], history[i], i)
+            self.credit_changes.extend(credits)
+            for label, change in models.items():
+                self.model_changes.setdefault(label, []).append(change)
+        self.label_versions = {label: self.version for label in self.model_changes}
+        self.stat = _history_stat()
+
+    def append(self, prev, entry, entry_count, trimmed):
+        """Thêm 1 entry mới (history đã ghi xong, bị cắt `trimmed` entry đầu)."""
+        self.version += 1
+        seq = self.first_seq + self.entry_count
+        self.entry_count = entry_count
+        self.first_seq += trimmed
+
+        credits, models = _entry_changes(prev, entry, seq) if prev else ([], {})
+        if credits:
+            self.credit_changes.extend(credits)
+            self.credit_version = self.version
+        for label, change in models.items():
+            self.model_changes.setdefault(label, []).append(change)
+            self.label_versions[label] = self.version
+
+        if trimmed:
+            # Change của entry đầu tiên còn lại không còn entry trước để so sánh
+            cut = _count_until(self.credit_changes, self.first_seq)
+            if cut:
+                del self.credit_changes[:cut]
+                self.credit_version = self.version
+            for label in list(self.model_changes):
+                changes = self.model_changes[label]
+                cut = _count_until(changes, self.first_seq)
+                if cut:
+                    del changes[:cut]
+                    self.label_versions[label] = self.version
+                    if not changes:
+                        del self.model_changes[label]
+        self.stat = _history_stat()
+
+    def _section(self, key, n, version, render):
+        cached = self._sections.get((key, n))
+        if cached and cached[0] >= version:
+            return cached[1]
+        text = render()
+        self._sections[(key, n)] = (self.version, text)
+        return text
+
+    def render(self, n):
+        lines = [
+            f"\n{'=' * 75}",
+            f"📜 LỊCH SỬ THAY ĐỔI (từ {self.entry_count} lần check)",
+            f"{'=' * 75}",
+        ]
+
+        # Credits
+        if self.credit_changes:
+            lines.append(self._section(
+                None, n, self.credit_version,
+                lambda: _render_credit_section(self.credit_changes[-n:]),
+            ))
+        else:
+            lines.append(f"\n  💰 Credits: Chưa có thay đổi")
+
+        # Models
+        if self.model_changes:
+            lines.append(f"\n  {'─' * 70}")
+            lines.append(f"  🤖 MODELS:")
+            lines.append(f"  {'─' * 70}")
+            for label in sorted(self.model_changes.keys()):
+                lines.append(self._section(
+                    label, n, self.label_versions[label],
+                    lambda: _render_model_section(label, self.model_changes[label][-n:]),
+                ))
+        else:
+            lines.append(f"\n  🤖 Models: Chưa có thay đổi")
+
+        lines.append(f"\n{'=' * 75}")
+        return "\n".join(lines)
+
+
+def _count_until(changes, first_seq):
+    """Số change ở đầu list có seq <= first_seq (đã rơi khỏi history)."""
+    cut = 0
+    while cut < len(changes) and changes[cut]["seq"] <= first_seq:
+        cut += 1
+    return cut
+
+
+def _render_credit_section(changes):
+    lines = [
+        f"\n  {'─' * 70}",
+        f"  💰 CREDITS:",
+        f"  {'─' * 70}",
+    ]
+    for c in changes:
+        sign = "+" if c["delta"] > 0 else ""
+        icon = "📈" if c["delta"] > 0 else "📉"
+        lines.append(f"  {icon} [{c['ts']}] {c['emoji']} {c['type']}: "
+                     f"{c['before']} → {c['after']} ({sign}{c['delta']})")
+    return "\n".join(lines)
+
+
+def _render_model_section(label, changes):
+    total_delta = sum(c["delta"] for c in changes)
+    sign_total = "+" if total_delta > 0 else ""
+    current = changes[-1]["after"]
+    lines = [f"\n  ▸ {label}  (hiện tại: {current}%, tổng thay đổi: {sign_total}{total_delta}%)"]
+    for c in changes:
+        sign = "+" if c["delta"] > 0 else ""
+        icon = "📈" if c["delta"] > 0 else "📉"
+        lines.append(f"    {icon} [{c['ts']}] {c['before']}% → {c['after']}% ({sign}{c['delta']}%)")
+    return "\n".join(lines)
+
+
+_change_log = ChangeLogCache()
+
+
 def show_change_log(n=50):
     """Hiển thị lịch sử thay đổi theo từng model + credits, có thời gian."""
-    history = load_history()
-    if len(history) < 2:
+    if not _change_log.is_current():
+        _change_log.rebuild(load_history())
+    if _change_log.entry_count < 2:
         print("\n📭 Cần ít nhất 2 lần check để có lịch sử thay đổi.")
         return
 
-    # Thu thập tất cả changes
-    credit_changes = []   # [{ts, type, before, after, delta}]
-    model_changes = {}     # {label: [{ts, before, after, delta}]}
+    print(_change_log.render(n))
 
-    for i in range(1, len(history)):
-        prev = history[i - 1]
-        curr = history[i]
-        ts = curr.get("timestamp", "?")
+
+# ============================================================
+#  PHẦN 6: Quota Alerts — rule engine chạy trên delta
+# ============================================================
+
+# Cấu hình alert (tuỳ chọn). Không có file = không đánh giá alert.
+# Ví dụ quota_alerts.json:
+# {
+#   "rules": [
+#     {"model": "*", "below": 30},
+#     {"model": "Claude*", "below": 10, "hysteresis": 10},
+#     {"credit": "prompt_credits", "below": 50}
+#   ],
+#   "hysteresis": 5,
+#   "debounce": 300,
+#   "sinks": [
+#     {"type": "stdout"},
+#     {"type": "webhook", "url": "http://127.0.0.1:8000/quota-alert"},
+#     {"type": "command", "command": "notify-send \"Quota alert\""}
+#   ]
+# }
+ALERTS_FILE = "quota_alerts.json"
+# Trạng thái armed / lần bắn cuối, giữ qua các lần chạy check_quota.py
+ALERTS_STATE_FILE = "quota_alerts_state.json"
+
+
+class AlertEngine:
+    """Đánh giá rule ngưỡng quota/credits, chỉ trên các key vừa thay đổi.
+
+    Mỗi (rule, key) có trạng thái armed: bắn alert khi giá trị xuống dưới
+    `below`, chỉ armed lại khi giá trị lên trên `below + hysteresis`.
+    Alert cùng key trong vòng `debounce` giây bị bỏ qua.
+    Nếu có state_file thì trạng thái được load/lưu ở đó, để hysteresis và
+    debounce vẫn đúng giữa các lần chạy check 1 lần (không chỉ trong monitor).
+    """
+
+    def __init__(self, config, state_file=None):
+        self.hysteresis = _config_number(config, "hysteresis", 5)
+        self.debounce = _config_number(config, "debounce", 300)
+        sinks = config.get("sinks") or [{"type": "stdout"}]
+        if not isinstance(sinks, list):
+            print(f"[WARN] {ALERTS_FILE}: 'sinks' phải là list, dùng stdout")
+            sinks = [{"type": "stdout"}]
+        self.sinks = [s for s in sinks if _valid_sink(s)]
+        rules = config.get("rules", [])
+        if not isinstance(rules, list):
+            print(f"[WARN] {ALERTS_FILE}: 'rules' phải là list, bỏ qua")
+            rules = []
+        rules = [r for r in rules if _valid_rule(r)]
+        self.model_rules = [r for r in rules if "model" in r]
+        self.credit_rules = [r for r in rules if "credit" in r]
+        self._rules_by_label = {}
+        self._armed = {}       # {"<rule json>|<key>": bool}
+        self._last_fired = {}  # {"<rule json>|<key>": datetime}
+        self._primed = False
+        self._dirty = False
+        self.fired = 0
+        self.state_file = state_file
+        if state_file:
+            self._load_state()
+
+    def _load_state(self):
         try:
-            dt = datetime.fromisoformat(ts)
-            ts_display = dt.strftime("%m/%d %H:%M:%S")
-        except:
-            ts_display = ts[:19]
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self._primed = bool(state.get("primed", False))
+            self._armed = {k: bool(v) for k, v in state.get("armed", {}).items()}
+            self._last_fired = {
+                k: datetime.fromisoformat(v) for k, v in state.get("last_fired", {}).items()
+            }
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
+            print(f"[WARN] {self.state_file} không hợp lệ, bỏ qua: {e}")
+
+    def _save_state(self):
+        state = {
+            "primed": self._primed,
+            "armed": self._armed,
+            "last_fired": {k: v.isoformat() for k, v in self._last_fired.items()},
+        }
+        try:
+            with open(self.state_file, "w", encoding="utf-8") as f:
+                json.dump(state, f, indent=2, ensure_ascii=False)
+        except OSError as e:
+            print(f"[WARN] Không lưu được {self.state_file}: {e}")
+
+    def _rules_for_label(self, label):
+        import fnmatch
+
+        rules = self._rules_by_label.get(label)
+        if rules is None:
+            rules = [
+                r for r in self.model_rules
+                if fnmatch.fnmatchcase(str(label), r["model"])
+            ]
+            self._rules_by_label[label] = rules
+        return rules
+
+    def evaluate(self, snapshot, deltas):
+        """Kiểm tra rule với snapshot mới. Trả về list alert đã gửi."""
+        if self._primed:
+            labels = deltas.get("models", {}).keys()
+            credit_keys = [k for k in ("prompt_credits", "flow_credits") if k in deltas]
+        else:
+            # Lần đầu: đánh giá toàn bộ snapshot để có trạng thái ban đầu
+            labels = snapshot["models"].keys()
+            credit_keys = ["prompt_credits", "flow_credits"]
+            self._primed = True
+            self._dirty = True
+
+        alerts = []
+        for label in labels:
+            frac = snapshot["models"].get(label)
+            if frac is None:
+                continue
+            value = round(frac * 100, 1)
+            for rule in self._rules_for_label(label):
+                alert = self._check(label, value, rule, "%")
+                if alert:
+                    alerts.append(alert)
+
+        for key in credit_keys:
+            value = snapshot.get(key)
+            if not isinstance(value, (int, float)):
+                continue
+            for rule in self.credit_rules:
+                if rule["credit"] == key:
+                    alert = self._check(key, value, rule, "")
+                    if alert:
+                        alerts.append(alert)
+
+        if self._dirty and self.state_file:
+            self._save_state()
+        self._dirty = False
+
+        self.fired += len(alerts)
+        for alert in alerts:
+            self._dispatch(alert)
+        return alerts
+
+    def _check(self, key, value, rule, unit):
+        # Key theo nội dung rule để state vẫn đúng khi thứ tự rule trong file đổi
+        state_key = f"{json.dumps(rule, sort_keys=True, ensure_ascii=False)}|{key}"
+        below = rule["below"]
+        armed = self._armed.get(state_key, True)
+
+        if value >= below + rule.get("hysteresis", self.hysteresis):
+            if not armed:
+                self._armed[state_key] = True
+                self._dirty = True
+            return None
+        if value >= below or not armed:
+            return None
+
+        self._armed[state_key] = False
+        self._dirty = True
+        now = _clock.now()
+        last = self._last_fired.get(state_key)
+        if last is not None and (now - last).total_seconds() < self.debounce:
+            return None
+        self._last_fired[state_key] = now
+
+        return {
+            "timestamp": now.isoformat(),
+            "key": key,
+            "value": value,
+            "threshold": below,
+            "message": f"{key} còn {value}{unit} (< {below}{unit})",
+        }
+
+    def _dispatch(self, alert):
+        for sink in self.sinks:
+            kind = sink.get("type", "stdout")
+            try:
+                if kind == "stdout":
+                    print(f"  🚨 ALERT: {alert['message']}")
+                elif kind == "webhook":
+                    _send_webhook(sink["url"], alert)
+                elif kind == "command":
+                    _run_alert_command(sink["command"], alert)
+            except Exception as e:
+                print(f"  [WARN] Alert sink '{kind}' lỗi: {e}")
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _config_number(config, key, default):
+    value = config.get(key, default)
+    if not _is_number(value):
+        print(f"[WARN] {ALERTS_FILE}: '{key}' phải là số, dùng {default}")
+        return default
+    return value
+
+
+def _valid_rule(rule):
+    """Kiểm tra kiểu dữ liệu của 1 rule; rule sai thì cảnh báo và bỏ qua."""
+    problem = None
+    if not isinstance(rule, dict):
+        problem = "không phải object"
+    elif not _is_number(rule.get("below")):
+        problem = "'below' phải là số"
+    elif "hysteresis" in rule and not _is_number(rule["hysteresis"]):
+        problem = "'hysteresis' phải là số"
+    elif ("model" in rule) == ("credit" in rule):
+        problem = "cần đúng 1 trong 'model' hoặc 'credit'"
+    elif "model" in rule and not isinstance(rule["model"], str):
+        problem = "'model' phải là chuỗi"
+    elif "credit" in rule and rule["credit"] not in ("prompt_credits", "flow_credits"):
+        problem = "'credit' phải là prompt_credits hoặc flow_credits"
+    if problem:
+        print(f"[WARN] {ALERTS_FILE}: bỏ qua rule {rule!r} — {problem}")
+        return False
+    return True
 
-        # Credits changes
-        for key, emoji, label in [
-            ("prompt_credits", "💳", "Prompt Credits"),
-            ("flow_credits", "🌊", "Flow Credits"),
-        ]:
-            prev_val = prev.get(key)
-            curr_val = curr.get(key)
-            if isinstance(prev_val, (int, float)) and isinstance(curr_val, (int, float)):
-                diff = curr_val - prev_val
-                if diff != 0:
-                    credit_changes.append({
-                        "ts": ts_display,
-                        "type": label,
-                        "emoji": emoji,
-                        "before": prev_val,
-                        "after": curr_val,
-                        "delta": diff,
-                    })
-
-        # Model changes
-        prev_models = {}
-        for m in prev.get("models", []):
-            prev_models[m["label"]] = m.get("remaining")
-
-        for m in curr.get("models", []):
-            label = m.get("label", "?")
-            curr_frac = m.get("remaining")
-            prev_frac = prev_models.get(label)
-
-            if prev_frac is not None and curr_frac is not None:
-                diff = round((curr_frac - prev_frac) * 100, 1)
-                if diff != 0:
-                    if label not in model_changes:
-                        model_changes[label] = []
-                    model_changes[label].append({
-                        "ts": ts_display,
-                        "before": round(prev_frac * 100, 1),
-                        "after": round(curr_frac * 100, 1),
-                        "delta": diff,
-                    })
-
-    # Hiển thị
-    print(f"\n{'=' * 75}")
-    print(f"📜 LỊCH SỬ THAY ĐỔI (từ {len(history)} lần check)")
-    print(f"{'=' * 75}")
-
-    # Credits
-    if credit_changes:
-        print(f"\n  {'─' * 70}")
-        print(f"  💰 CREDITS:")
-        print(f"  {'─' * 70}")
-        for c in credit_changes[-n:]:
-            sign = "+" if c["delta"] > 0 else ""
-            icon = "📈" if c["delta"] > 0 else "📉"
-            print(f"  {icon} [{c['ts']}] {c['emoji']} {c['type']}: "
-                  f"{c['before']} → {c['after']} ({sign}{c['delta']})")
-    else:
-        print(f"\n  💰 Credits: Chưa có thay đổi")
 
-    # Models
-    if model_changes:
-        print(f"\n  {'─' * 70}")
-        print(f"  🤖 MODELS:")
-        print(f"  {'─' * 70}")
-        for label in sorted(model_changes.keys()):
-            changes = model_changes[label][-n:]
-            total_delta = sum(c["delta"] for c in changes)
-            sign_total = "+" if total_delta > 0 else ""
-            current = changes[-1]["after"]
-            print(f"\n  ▸ {label}  (hiện tại: {current}%, tổng thay đổi: {sign_total}{total_delta}%)")
-            for c in changes:
-                sign = "+" if c["delta"] > 0 else ""
-                icon = "📈" if c["delta"] > 0 else "📉"
-                print(f"    {icon} [{c['ts']}] {c['before']}% → {c['after']}% ({sign}{c['delta']}%)")
-    else:
-        print(f"\n  🤖 Models: Chưa có thay đổi")
+def _valid_sink(sink):
+    """Kiểm tra 1 sink; sink sai thì cảnh báo và bỏ qua."""
+    problem = None
+    if not isinstance(sink, dict):
+        problem = "không phải object"
+    elif sink.get("type", "stdout") not in ("stdout", "webhook", "command"):
+        problem = "'type' phải là stdout, webhook hoặc command"
+    elif sink.get("type") == "webhook" and not isinstance(sink.get("url"), str):
+        problem = "webhook cần 'url' dạng chuỗi"
+    elif sink.get("type") == "command" and not isinstance(sink.get("command"), str):
+        problem = "command cần 'command' dạng chuỗi"
+    if problem:
+        print(f"[WARN] {ALERTS_FILE}: bỏ qua sink {sink!r} — {problem}")
+        return False
+    return True
+
+
+def _send_webhook(url, alert):
+    """POST alert JSON đến webhook local."""
+    import urllib.request
+
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(alert, ensure_ascii=False).encode("utf-8"),
+        method="POST",
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(req, timeout=5):
+        pass
+
+
+def _run_alert_command(command, alert):
+    """Chạy command, alert JSON qua stdin + biến môi trường QUOTA_ALERT_*."""
+    import os
+    import subprocess
+
+    env = dict(os.environ)
+    env["QUOTA_ALERT_KEY"] = str(alert["key"])
+    env["QUOTA_ALERT_VALUE"] = str(alert["value"])
+    env["QUOTA_ALERT_MESSAGE"] = alert["message"]
+    subprocess.run(
+        command, shell=True, input=json.dumps(alert, ensure_ascii=False),
+        text=True, env=env, timeout=15,
+    )
+
 
-    print(f"\n{'=' * 75}")
+_alert_engine = None
+
+
+def get_alert_engine():
+    """Load AlertEngine từ ALERTS_FILE (1 lần). Trả về None nếu không cấu hình."""
+    global _alert_engine
+    if _alert_engine is None:
+        try:
+            with open(ALERTS_FILE, "r", encoding="utf-8") as f:
+                _alert_engine = AlertEngine(json.load(f), state_file=ALERTS_STATE_FILE)
+        except FileNotFoundError:
+            _alert_engine = False
+        except (json.JSONDecodeError, AttributeError) as e:
+            print(f"[WARN] {ALERTS_FILE} không hợp lệ: {e}")
+            _alert_engine = False
+    return _alert_engine or None
 
 
 # ============================================================
-#  PHẦN 6: Kết nối đến Antigravity process
+#  PHẦN 7: Kết nối đến Antigravity process
 # ============================================================
 
 def connect_to_antigravity(quiet=False):
@@ -695,7 +1192,7 @@ def connect_to_antigravity(quiet=False):
 
 
 # ============================================================
-#  PHẦN 7: MAIN + Monitor Mode
+#  PHẦN 8: MAIN + Monitor Mode
 # ============================================================
 
 def main():
@@ -718,8 +1215,6 @@ def main():
 
 def monitor(interval=60):
     """Chế độ giám sát liên tục — poll mỗi N giây, chỉ ghi khi có thay đổi."""
-    import time
-
     print(f"🔄 MONITOR MODE — Check mỗi {interval} giây (Ctrl+C để dừng)")
     print(f"   Chỉ ghi lịch sử khi quota THAY ĐỔI\n")
 
@@ -728,65 +1223,616 @@ def monitor(interval=60):
         sys.exit(1)
     port, token = conn
 
+    def fetch(now):
+        nonlocal port, token
+        data = get_user_status(port, token)
+        if not data:
+            # Có thể process restart, thử reconnect
+            print(f"  [{now}] ⚠️  Mất kết nối, đang thử lại...")
+            conn = connect_to_antigravity(quiet=True)
+            if conn:
+                port, token = conn
+                data = get_user_status(port, token)
+        return data
+
+    stats = {"checks": 0, "changes": 0}
+    try:
+        monitor_loop(fetch, interval, stats)
+    except KeyboardInterrupt:
+        print(f"\n\n🛑 Dừng monitor. Tổng: {stats['checks']} checks, {stats['changes']} thay đổi")
+        print(format_path_stats(stats))
+        show_change_log()
+
+
+def monitor_loop(fetch, interval, stats, max_checks=None, save_raw=True):
+    """Vòng lặp monitor: fetch(now) → save_to_history → hiển thị khi đổi.
+
+    Dùng chung cho monitor thật và replay (fetch + _clock ảo).
+    Dừng sau max_checks lần (None = chạy mãi) hoặc khi fetch raise StopIteration.
+
+    Fast path: giữ digest của snapshot trước trong memory; poll có digest
+    giống hệt thì dừng ngay, không load history / tính delta / ghi disk.
+    stats ghi số tick + thời gian xử lý của fast path và full path.
+    """
+    import time
+
+    stats.update(fast_path=0, full_path=0, fast_time=0.0, full_time=0.0)
+    last_digest = None
+
     # Lần đầu luôn check + display
-    data = get_user_status(port, token)
+    data = fetch(_clock.now().strftime("%H:%M:%S"))
     if data:
-        display_quota(data)
-        save_to_history(data, force=True)
+        entry = _build_entry(data, None)
+        display_quota(data, save_raw=save_raw)
+        save_to_history(data, force=True, entry=entry)
+        last_digest = _snapshot_digest(_entry_snapshot(entry))
+    stats["checks"] = 1
+
+    while max_checks is None or stats["checks"] < max_checks:
+        _clock.sleep(interval)
+        now = _clock.now().strftime("%H:%M:%S")
+
+        try:
+            data = fetch(now)
+        except StopIteration:
+            break
+        stats["checks"] += 1
+
+        if not data:
+            print(f"  [{now}] ❌ Không lấy được data (check #{stats['checks']})")
+            continue
+
+        t0 = time.perf_counter()
+        entry = _build_entry(data, None)
+        digest = _snapshot_digest(_entry_snapshot(entry))
+        if digest == last_digest:
+            stats["fast_path"] += 1
+            print(f"  [{now}] ✅ Không đổi ⚡ (check #{stats['checks']}, {stats['changes']} changes)")
+            stats["fast_time"] += time.perf_counter() - t0
+            continue
+
+        stats["full_path"] += 1
+        last_digest = digest
+        changed = save_to_history(data, entry=entry)
+        if changed:
+            stats["changes"] += 1
+            # Hiện bảng quota + change log khi có thay đổi
+            display_quota(data, save_raw=save_raw)
+            show_change_log(20)
+        else:
+            print(f"  [{now}] ✅ Không đổi (check #{stats['checks']}, {stats['changes']} changes)")
+        stats["full_time"] += time.perf_counter() - t0
+
+    return stats
+
+
+def format_path_stats(stats):
+    """Tóm tắt fast path / full path: số tick và thời gian trung bình mỗi tick."""
+    lines = []
+    for key, name in (("fast", "Fast path"), ("full", "Full path")):
+        count = stats.get(f"{key}_path", 0)
+        total = stats.get(f"{key}_time", 0.0)
+        avg = total / count * 1000 if count else 0.0
+        lines.append(f"   {name + ':':<20}{count} ticks, {avg:.3f} ms/tick")
+    return "\n".join(lines)
+
+
+# ============================================================
+#  PHẦN 9: Replay Mode — chạy monitor loop với đồng hồ ảo
+# ============================================================
+
+SYNTHETIC_MODELS = [
+    "Gemini 3 Pro (High)",
+    "Gemini 3 Pro (Low)",
+    "Gemini 3 Flash",
+    "Claude Sonnet 4.5",
+    "Claude Sonnet 4.5 (Thinking)",
+    "Claude Opus 4.5 (Thinking)",
+    "GPT-OSS 120B (Medium)",
+]
+
+
+RAW_PREFIX = "quota_raw_"
+
+
+def _raw_dump_time(path):
+    """Thời điểm chụp raw dump: từ tên file (quota_raw_YYYY-mm-dd_HHMMSS.json), fallback mtime."""
+    import os
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    try:
+        return datetime.strptime(stem[len(RAW_PREFIX):], "%Y-%m-%d_%H%M%S")
+    except ValueError:
+        return datetime.fromtimestamp(os.path.getmtime(path))
+
+
+def list_raw_dumps(pattern=RAW_PREFIX + "*.json"):
+    """Danh sách (thời điểm chụp, path) của các raw dump, sắp theo thời gian."""
+    import glob
+
+    return sorted((_raw_dump_time(path), path) for path in glob.glob(pattern))
+
 
-    check_count = 1
-    change_count = 0
+def iter_raw_dumps(paths):
+    """Đọc lần lượt các file raw dump; file lỗi trả về None (= poll thất bại)."""
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                yield json.load(f)
+        except (OSError, json.JSONDecodeError, UnicodeDecodeError):
+            yield None
+
+
+def iter_synthetic_responses(template=None, seed=0, reset_hours=5):
+    """Sinh GetUserStatus response giả lập: quota giảm ngẫu nhiên, reset theo chu kỳ."""
+    import copy
+    import random
+
+    rng = random.Random(seed)
+    if template is None:
+        template = {
+            "userStatus": {
+                "name": "Replay",
+                "email": "replay@localhost",
+                "planStatus": {
+                    "planInfo": {"planName": "Synthetic", "monthlyPromptCredits": 500,
+                                 "monthlyFlowCredits": 100},
+                    "availablePromptCredits": 500,
+                    "availableFlowCredits": 100,
+                },
+                "cascadeModelConfigData": {
+                    "clientModelConfigs": [
+                        {"label": label, "modelOrAlias": {"model": f"MODEL_{i}"},
+                         "quotaInfo": {"remainingFraction": 1.0}}
+                        for i, label in enumerate(SYNTHETIC_MODELS)
+                    ]
+                },
+            }
+        }
+    data = copy.deepcopy(template)
+    us = data.get("userStatus", data)
+    plan_status = us.setdefault("planStatus", {})
+    configs = us.get("cascadeModelConfigData", {}).get("clientModelConfigs", [])
+
+    period = timedelta(hours=reset_hours)
+    resets = [_clock.utcnow() + period for _ in configs]
+
+    while True:
+        now = _clock.utcnow()
+        for i, cfg in enumerate(configs):
+            quota = cfg.setdefault("quotaInfo", {})
+            frac = quota.get("remainingFraction")
+            if now >= resets[i]:
+                quota["remainingFraction"] = 1.0
+                while resets[i] <= now:
+                    resets[i] += period
+            elif frac and rng.random() < 0.02:
+                quota["remainingFraction"] = round(max(0.0, frac - 0.2), 4)
+            quota["resetTime"] = resets[i].strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        credits = plan_status.get("availablePromptCredits")
+        if isinstance(credits, (int, float)) and credits > 0 and rng.random() < 0.01:
+            plan_status["availablePromptCredits"] = credits - 1
+
+        # Trả bản copy — history/delta không được giữ reference tới object đang mutate
+        yield copy.deepcopy(data)
+
+
+def replay(source, interval=30, max_checks=None, history_file="quota_history_replay.json",
+           start=None, verbose=False, alerts=None, timeline=None):
+    """Chạy monitor_loop thật với data từ source (iterator) dưới đồng hồ ảo.
+
+    timeline: các mốc thời gian cho từng poll sau poll đầu (xem VirtualClock);
+    None = cách nhau `interval` giây.
+    Ghi history ra file riêng để không đụng quota_history.json. Alert engine
+    toàn cục được thay bằng `alerts` (None = tắt alert) để data giả không
+    bắn webhook/command thật.
+    Trả về dict stats gồm checks, changes, alerts, elapsed, polls_per_sec.
+    """
+    import contextlib
+    import io
+    import os
+    import time
+
+    global _clock, HISTORY_FILE, _alert_engine
+
+    def fetch(now):
+        return next(source)
+
+    if os.path.abspath(history_file) == os.path.abspath(HISTORY_FILE):
+        raise ValueError(f"Replay không được ghi đè history thật ({HISTORY_FILE})")
+    if os.path.exists(history_file):
+        os.remove(history_file)
+
+    saved_clock, saved_history, saved_alerts = _clock, HISTORY_FILE, _alert_engine
+    _clock, HISTORY_FILE = VirtualClock(start, timeline), history_file
+    _alert_engine = alerts or False
+    sim_start = _clock.now()
+    stats = {"checks": 0, "changes": 0}
+    out = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    t0 = time.perf_counter()
+    try:
+        with out:
+            try:
+                monitor_loop(fetch, interval, stats, max_checks=max_checks, save_raw=False)
+            except StopIteration:
+                pass  # source rỗng ngay từ đầu
+        stats["elapsed"] = time.perf_counter() - t0
+        stats["simulated"] = _clock.now() - sim_start
+    finally:
+        _clock, HISTORY_FILE, _alert_engine = saved_clock, saved_history, saved_alerts
+
+    stats["alerts"] = alerts.fired if alerts else 0
+    stats["polls_per_sec"] = stats["checks"] / stats["elapsed"] if stats["elapsed"] else 0.0
+    return stats
+
+
+# ============================================================
+#  PHẦN 10: Bulk Import — gộp quota_raw_*.json vào history
+# ============================================================
+
+# display_quota ghi dump cùng lúc với save_to_history nhưng tên file chỉ
+# có đến giây → coi là trùng nếu lệch trong khoảng này và snapshot giống nhau
+DUPLICATE_WINDOW = timedelta(seconds=5)
+
+
+def _parse_raw_dump(path):
+    """Worker: đọc 1 raw dump → history entry (None nếu lỗi).
+
+    Timestamp lấy từ _raw_dump_time.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    if not isinstance(data, dict):
+        return None
 
     try:
-        while True:
-            time.sleep(interval)
-            check_count += 1
-            now = datetime.now().strftime("%H:%M:%S")
-
-            # Thử lấy data (quiet mode)
-            data = get_user_status(port, token)
-            if not data:
-                # Có thể process restart, thử reconnect
-                print(f"  [{now}] ⚠️  Mất kết nối, đang thử lại...")
-                conn = connect_to_antigravity(quiet=True)
-                if conn:
-                    port, token = conn
-                    data = get_user_status(port, token)
-
-            if not data:
-                print(f"  [{now}] ❌ Không lấy được data (check #{check_count})")
+        entry = _build_entry(data, _raw_dump_time(path).isoformat())
+    except (AttributeError, TypeError):
+        # JSON hợp lệ nhưng sai cấu trúc (vd. {"userStatus": null})
+        return None
+    if not entry["models"]:
+        return None
+    return entry
+
+
+def _entry_sort_key(entry):
+    try:
+        return datetime.fromisoformat(entry.get("timestamp", ""))
+    except ValueError:
+        return datetime.min
+
+
+def _is_duplicate(entry, existing_times, existing, window=DUPLICATE_WINDOW):
+    """Entry import có trùng entry cũ không (lệch <= window và cùng snapshot)."""
+    import bisect
+
+    ts = _entry_sort_key(entry)
+    digest = _snapshot_digest(_entry_snapshot(entry))
+    i = bisect.bisect_left(existing_times, ts - window)
+    while i < len(existing_times) and existing_times[i] <= ts + window:
+        if existing[i][1] == digest:
+            return True
+        i += 1
+    return False
+
+
+def merge_history(history, imported):
+    """Gộp entries import vào history: sắp theo thời gian, bỏ trùng.
+
+    Entry cũ luôn được giữ nguyên; chỉ entry cũ đứng ngay sau một entry
+    import mới được tính lại deltas. Entry import bị bỏ nếu trùng entry cũ
+    (xem _is_duplicate) hoặc không thay đổi gì so với entry liền trước
+    (giống save_to_history). Trả về (history mới, số entry import còn lại sau khi cắt).
+    """
+    existing = sorted(
+        (_entry_sort_key(e), _snapshot_digest(_entry_snapshot(e))) for e in history
+    )
+    existing_times = [t for t, _ in existing]
+
+    tagged = [(e, False) for e in history]
+    for e in imported:
+        if not _is_duplicate(e, existing_times, existing):
+            tagged.append((e, True))
+    tagged.sort(key=lambda t: _entry_sort_key(t[0]))
+
+    merged = []
+    new_flags = []
+    prev_new = False
+    for entry, is_new in tagged:
+        if not is_new and not prev_new:
+            merged.append(entry)
+            new_flags.append(False)
+            continue
+        deltas = {}
+        if merged:
+            deltas = _compute_deltas(merged[-1], _entry_snapshot(entry))
+            if is_new and not deltas:
                 continue
+        entry = dict(entry)
+        entry.pop("deltas", None)
+        if deltas:
+            entry["deltas"] = deltas
+        merged.append(entry)
+        new_flags.append(is_new)
+        prev_new = is_new
+
+    # Chỉ đếm entry import còn lại sau khi cắt về MAX_HISTORY_ENTRIES
+    if len(merged) > MAX_HISTORY_ENTRIES:
+        merged = merged[-MAX_HISTORY_ENTRIES:]
+        new_flags = new_flags[-MAX_HISTORY_ENTRIES:]
+    return merged, sum(new_flags)
+
+
+def _write_history_stream(entries, path):
+    """Ghi history từng entry một ra file tạm rồi thay thế (atomic)."""
+    import os
+
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, entry in enumerate(entries):
+            f.write(",\n  " if i else "\n  ")
+            f.write(json.dumps(entry, indent=2, ensure_ascii=False).replace("\n", "\n  "))
+        f.write("\n]" if entries else "]")
+    os.replace(tmp, path)
+
+
+def import_raw_dumps(pattern=RAW_PREFIX + "*.json", workers=None):
+    """Parse song song các raw dump (process pool) và gộp vào HISTORY_FILE."""
+    import glob
+    import os
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        print(f"📭 Không tìm thấy file nào khớp {pattern}")
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    print(f"📥 Import {len(paths)} file với {workers} process...")
+
+    t0 = time.perf_counter()
+    imported = []
+    step = max(1, len(paths) // 10)
+    chunksize = max(1, len(paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for i, entry in enumerate(pool.map(_parse_raw_dump, paths, chunksize=chunksize), 1):
+            if entry is not None:
+                imported.append(entry)
+            if i % step == 0 or i == len(paths):
+                rate = i / (time.perf_counter() - t0)
+                print(f"  ⏳ {i}/{len(paths)} file ({rate:.0f} file/giây)")
+    parse_time = time.perf_counter() - t0
+
+    history, added = merge_history(load_history(), imported)
+    if added:
+        _write_history_stream(history, HISTORY_FILE)
+
+    total = time.perf_counter() - t0
+    skipped = len(paths) - len(imported)
+    print(f"\n✅ Thêm {added} entries mới ({len(imported) - added} trùng/không đổi/bị cắt, "
+          f"{skipped} file lỗi)")
+    print(f"   Parse: {parse_time:.2f}s ({len(paths) / parse_time:.0f} file/giây), "
+          f"tổng: {total:.2f}s")
+    print(f"   📊 History: {len(history)} entries")
+    return added
 
-            changed = save_to_history(data)
-            if changed:
-                change_count += 1
-                # Hiện bảng quota + change log khi có thay đổi
-                display_quota(data)
-                show_change_log(20)
-            else:
-                print(f"  [{now}] ✅ Không đổi (check #{check_count}, {change_count} changes)")
 
-    except KeyboardInterrupt:
-        print(f"\n\n🛑 Dừng monitor. Tổng: {check_count} checks, {change_count} thay đổi")
-        show_change_log()
+# ============================================================
+#  PHẦN 11: CLI — Subcommand handlers
+# ============================================================
 
+def _int_arg(args, default):
+    """Lấy tham số số nguyên đầu tiên, trả về default nếu không có."""
+    if args and args[0].isdigit():
+        return int(args[0])
+    return default
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        main()
-    elif sys.argv[1] in ("history", "--history"):
-        show_history(int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 20)
-    elif sys.argv[1] in ("log", "--log", "-l"):
-        show_change_log(int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 50)
-    elif sys.argv[1] in ("monitor", "--monitor", "-m"):
-        interval = 30
-        if len(sys.argv) > 2 and sys.argv[2].isdigit():
-            interval = max(10, int(sys.argv[2]))
-        monitor(interval)
+
+def cmd_check(args):
+    """Check 1 lần + hiện change log (cần kết nối Antigravity)."""
+    main()
+
+
+def cmd_history(args):
+    """Xem N entries gần nhất (offline)."""
+    show_history(_int_arg(args, 20))
+
+
+def cmd_log(args):
+    """Xem lịch sử thay đổi từng model (offline)."""
+    show_change_log(_int_arg(args, 50))
+
+
+def cmd_monitor(args):
+    """Giám sát liên tục mỗi N giây (cần kết nối Antigravity)."""
+    monitor(max(10, _int_arg(args, 30)))
+
+
+def _seed_bench_history(path, polls=15000):
+    """Tạo history giả lập cho bench-startup (không đụng history thật)."""
+    source = iter_synthetic_responses(seed=0)
+    start = datetime(2026, 1, 1)
+    entries = [
+        _build_entry(next(source), (start + timedelta(seconds=30 * i)).isoformat())
+        for i in range(polls)
+    ]
+    history, _ = merge_history([], entries)
+    _write_history_stream(history, path)
+    return len(history)
+
+
+def cmd_bench_startup(args):
+    """Đo thời gian khởi động (cold start) của từng subcommand offline.
+
+    So sánh với bản import eager ssl/urllib.request/subprocess (như trước
+    khi tách lazy import) trên cùng một history, để thấy phần tiết kiệm.
+    """
+    import os
+    import statistics
+    import subprocess
+    import tempfile
+    import time
+
+    runs = _int_arg(args, 10)
+    script = os.path.abspath(__file__)
+    eager = (
+        "import ssl, urllib.request, subprocess, re, runpy, sys; "
+        f"sys.argv = [{script!r}] + sys.argv[1:]; "
+        f"runpy.run_path({script!r}, run_name='__main__')"
+    )
+    cases = [
+        ("python (baseline)", [sys.executable, "-c", "pass"]),
+        ("history (eager)", [sys.executable, "-c", eager, "history", "1"]),
+        ("history", [sys.executable, script, "history", "1"]),
+        ("log (eager)", [sys.executable, "-c", eager, "log", "1"]),
+        ("log", [sys.executable, script, "log", "1"]),
+    ]
+
+    # Chạy trong thư mục tạm để không đọc history thật; dùng bản sao
+    # history thật nếu có, không thì tạo history giả lập
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_history = os.path.join(tmp, "quota_history.json")
+        if os.path.exists(HISTORY_FILE):
+            import shutil
+            shutil.copyfile(HISTORY_FILE, bench_history)
+            size = len(load_history())
+        else:
+            size = _seed_bench_history(bench_history)
+
+        print(f"\n⏱️  STARTUP BENCHMARK ({runs} lần mỗi lệnh, median, history {size} entries)")
+        print(f"{'─' * 50}")
+        medians = {}
+        for label, argv in cases:
+            samples = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                subprocess.run(argv, cwd=tmp, capture_output=True)
+                samples.append((time.perf_counter() - start) * 1000)
+            medians[label] = statistics.median(samples)
+            print(f"  {label:<20} {medians[label]:>8.1f} ms"
+                  f"   (min {min(samples):.1f} ms)")
+    print(f"{'─' * 50}")
+    for name in ("history", "log"):
+        ratio = medians[name] / medians[f"{name} (eager)"]
+        print(f"  {name:<20} {ratio:>8.0%} thời gian so với eager import")
+
+
+def cmd_replay(args):
+    """Replay monitor loop với đồng hồ ảo (offline), báo polls/giây."""
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(prog="check_quota.py replay")
+    parser.add_argument("--days", type=float, default=1.0, help="Số ngày mô phỏng (synthetic)")
+    parser.add_argument("--interval", type=int, default=30,
+                        help="Giây giữa 2 lần poll (synthetic)")
+    parser.add_argument("--dumps", metavar="GLOB",
+                        help="Replay các file raw dump thay vì synthetic, "
+                             "theo đúng thời điểm chụp trong tên file")
+    parser.add_argument("--template", metavar="FILE", help="Raw dump làm mẫu cho synthetic")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="quota_history_replay.json")
+    parser.add_argument("--alerts", metavar="FILE",
+                        help="Đánh giá rule từ file alert (chỉ in ra stdout, không gọi sink thật)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="In output của monitor")
+    opts = parser.parse_args(args)
+    if opts.interval <= 0:
+        parser.error("--interval phải > 0")
+    if os.path.abspath(opts.out) == os.path.abspath(HISTORY_FILE):
+        parser.error(f"--out không được trùng history thật ({HISTORY_FILE})")
+
+    start = timeline = None
+    if opts.dumps:
+        dumps = list_raw_dumps(opts.dumps)
+        source = iter_raw_dumps([path for _, path in dumps])
+        max_checks = None
+        if dumps:
+            start = dumps[0][0]
+            timeline = iter([ts for ts, _ in dumps[1:]])
     else:
-        print("Usage:")
-        print("  python check_quota.py              # Check 1 lần + hiện change log")
-        print("  python check_quota.py log [N]       # Xem lịch sử thay đổi từng model")
-        print("  python check_quota.py history [N]   # Xem N entries gần nhất")
-        print("  python check_quota.py monitor [N]   # Giám sát liên tục mỗi N giây")
+        template = None
+        if opts.template:
+            with open(opts.template, "r", encoding="utf-8") as f:
+                template = json.load(f)
+        source = iter_synthetic_responses(template, seed=opts.seed)
+        max_checks = max(1, int(opts.days * 86400 / opts.interval))
+
+    alerts = None
+    if opts.alerts:
+        with open(opts.alerts, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        # Data giả lập: không gọi webhook/command thật, không đụng state file
+        config["sinks"] = [{"type": "stdout"}]
+        alerts = AlertEngine(config)
+
+    stats = replay(source, opts.interval, max_checks, opts.out, start=start,
+                   verbose=opts.verbose, alerts=alerts, timeline=timeline)
+
+    print(f"\n🎞️  REPLAY — {stats['checks']} polls, {stats['changes']} thay đổi")
+    print(f"   Thời gian mô phỏng: {stats['simulated']}")
+    print(f"   Thời gian thực:     {stats['elapsed']:.2f}s")
+    print(f"   Throughput:         {stats['polls_per_sec']:.0f} polls/giây")
+    print(format_path_stats(stats))
+    if alerts:
+        print(f"   Alerts:             {stats['alerts']}")
+    print(f"   History:            {opts.out}")
+
+
+def cmd_import(args):
+    """Gộp các file quota_raw_*.json vào history (process pool)."""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="check_quota.py import")
+    parser.add_argument("pattern", nargs="?", default=RAW_PREFIX + "*.json",
+                        help="Glob các raw dump")
+    parser.add_argument("-j", "--workers", type=int, help="Số process (mặc định = số core)")
+    opts = parser.parse_args(args)
+    import_raw_dumps(opts.pattern, opts.workers)
+
+
+COMMANDS = {
+    "history": cmd_history,
+    "--history": cmd_history,
+    "log": cmd_log,
+    "--log": cmd_log,
+    "-l": cmd_log,
+    "monitor": cmd_monitor,
+    "--monitor": cmd_monitor,
+    "-m": cmd_monitor,
+    "bench-startup": cmd_bench_startup,
+    "replay": cmd_replay,
+    "import": cmd_import,
+}
+
+
+def print_usage():
+    print("Usage:")
+    print("  python check_quota.py              # Check 1 lần + hiện change log")
+    print("  python check_quota.py log [N]       # Xem lịch sử thay đổi từng model")
+    print("  python check_quota.py history [N]   # Xem N entries gần nhất")
+    print("  python check_quota.py monitor [N]   # Giám sát liên tục mỗi N giây")
+    print("  python check_quota.py import [GLOB]     # Gộp quota_raw_*.json vào history")
+    print("  python check_quota.py replay [--days D] # Replay monitor với đồng hồ ảo")
+    print("  python check_quota.py bench-startup [N]  # Đo thời gian khởi động")
+
+
+def run_cli(argv):
+    """Dispatch subcommand từ argv (không gồm tên script)."""
+    if not argv:
+        cmd_check([])
+        return
+    handler = COMMANDS.get(argv[0])
+    if handler is None:
+        print_usage()
+        return
+    handler(argv[1:])
+
 
+if __name__ == "__main__":
+    run_cli(sys.argv[1:])
@@ -0,0 +1,323 @@
+import json
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import check_quota as cq  # noqa: E402
+
+
+def _response(fractions, prompt_credits=500):
+    return {
+        "userStatus": {
+            "name": "Test",
+            "email": "test@localhost",
+            "planStatus": {
+                "planInfo": {"planName": "Pro"},
+                "availablePromptCredits": prompt_credits,
+                "availableFlowCredits": 100,
+            },
+            "cascadeModelConfigData": {
+                "clientModelConfigs": [
+                    {"label": label, "quotaInfo": {"remainingFraction": frac}}
+                    for label, frac in fractions.items()
+                ]
+            },
+        }
+    }
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cq, "_clock", cq.VirtualClock(datetime(2026, 1, 1, 10, 10, 0, 500000)))
+    monkeypatch.setattr(cq, "_alert_engine", None)
+    return tmp_path
+
+
+def _check_once(data):
+    """Giống main(): dump raw + lưu history trong cùng một giây."""
+    cq.display_quota(data)
+    cq.save_to_history(data)
+
+
+def test_import_skips_dumps_already_in_history(workdir):
+    for frac in (1.0, 0.8, 0.6):
+        _check_once(_response({"Gemini 3 Flash": frac, "Claude Sonnet 4.5": 1.0}))
+        cq._clock.sleep(600)
+    before = cq.load_history()
+    assert len(before) == 3
+    assert len(list(workdir.glob("quota_raw_*.json"))) == 3
+
+    added = cq.import_raw_dumps(workers=2)
+
+    assert added == 0
+    assert cq.load_history() == before
+
+
+def test_import_inserts_missing_dump_into_non_empty_history(workdir):
+    _check_once(_response({"Gemini 3 Flash": 1.0}))
+    cq._clock.sleep(3600)
+    _check_once(_response({"Gemini 3 Flash": 0.4}))
+    assert cq.load_history()[1]["deltas"] == {"models": {"Gemini 3 Flash": -60.0}}
+
+    # Dump từ trước khi có history entry tương ứng
+    missing = cq._clock.now() - timedelta(minutes=30)
+    name = f"quota_raw_{missing.strftime('%Y-%m-%d_%H%M%S')}.json"
+    (workdir / name).write_text(json.dumps(_response({"Gemini 3 Flash": 0.8})), encoding="utf-8")
+
+    added = cq.import_raw_dumps(workers=2)
+
+    history = cq.load_history()
+    assert added == 1
+    assert [m["models"][0]["remaining"] for m in history] == [1.0, 0.8, 0.4]
+    assert history[1]["deltas"] == {"models": {"Gemini 3 Flash": -20.0}}
+    assert history[2]["deltas"] == {"models": {"Gemini 3 Flash": -40.0}}
+
+
+def test_malformed_alert_rules_are_skipped(workdir, capsys):
+    engine = cq.AlertEngine({
+        "rules": [
+            {"model": "*", "below": "30"},
+            {"model": 5, "below": 30},
+            {"credit": "prompt_credits", "below": 50, "hysteresis": "x"},
+            {"model": "Gemini*", "below": 30},
+        ],
+    })
+    assert engine.model_rules == [{"model": "Gemini*", "below": 30}]
+    assert engine.credit_rules == []
+    assert capsys.readouterr().out.count("[WARN]") == 3
+
+    cq._alert_engine = engine
+    cq.save_to_history(_response({"Gemini 3 Flash": 0.2}))
+    assert "ALERT: Gemini 3 Flash" in capsys.readouterr().out
+
+
+def test_alert_state_persists_between_runs(workdir, capsys):
+    config = {"rules": [{"model": "*", "below": 30}], "debounce": 0}
+
+    def run(frac):
+        # Mỗi lần chạy là một process mới: engine load lại từ state file
+        cq._alert_engine = cq.AlertEngine(config, state_file=cq.ALERTS_STATE_FILE)
+        cq.save_to_history(_response({"Gemini 3 Flash": frac}))
+        cq._clock.sleep(60)
+        return capsys.readouterr().out.count("ALERT:")
+
+    assert run(0.2) == 1
+    # Vẫn dưới ngưỡng → không alert lại
+    assert run(0.1) == 0
+    # Lên trên ngưỡng + hysteresis thì armed lại
+    assert run(0.8) == 0
+    assert run(0.2) == 1
+
+
+def test_replay_isolates_global_alert_engine(workdir):
+    global_engine = cq.AlertEngine({"rules": [{"model": "*", "below": 101}]})
+    cq._alert_engine = global_engine
+    replay_engine = cq.AlertEngine({"rules": [{"model": "*", "below": 101}]})
+
+    stats = cq.replay(cq.iter_synthetic_responses(), max_checks=5, alerts=replay_engine)
+
+    assert stats["alerts"] == len(cq.SYNTHETIC_MODELS)
+    assert global_engine.fired == 0
+    assert cq._alert_engine is global_engine
+
+
+def test_replay_dumps_follow_capture_times(workdir):
+    times = [datetime(2026, 1, 1, 8, 0), datetime(2026, 1, 1, 8, 7), datetime(2026, 1, 1, 13, 30)]
+    for ts, frac in zip(times, (1.0, 0.8, 0.6)):
+        name = f"quota_raw_{ts.strftime('%Y-%m-%d_%H%M%S')}.json"
+        (workdir / name).write_text(json.dumps(_response({"Gemini 3 Flash": frac})), encoding="utf-8")
+
+    dumps = cq.list_raw_dumps()
+    stats = cq.replay(
+        cq.iter_raw_dumps([path for _, path in dumps]),
+        interval=30,
+        history_file="replay.json",
+        start=dumps[0][0],
+        timeline=iter([ts for ts, _ in dumps[1:]]),
+    )
+
+    assert stats["checks"] == 3
+    assert stats["simulated"] == times[-1] - times[0]
+    cq.HISTORY_FILE = "replay.json"
+    try:
+        assert [e["timestamp"] for e in cq.load_history()] == [t.isoformat() for t in times]
+    finally:
+        cq.HISTORY_FILE = "quota_history.json"
+
+
+def test_forced_save_alerts_on_change_since_last_run(workdir, capsys):
+    config = {"rules": [{"model": "*", "below": 30}]}
+    cq._alert_engine = cq.AlertEngine(config, state_file=cq.ALERTS_STATE_FILE)
+    cq.save_to_history(_response({"Gemini 3 Flash": 0.9}))
+    capsys.readouterr()
+
+    # Lần chạy sau (monitor luôn save lần đầu với force=True), quota đã tụt
+    cq._alert_engine = cq.AlertEngine(config, state_file=cq.ALERTS_STATE_FILE)
+    cq._clock.sleep(3600)
+    cq.save_to_history(_response({"Gemini 3 Flash": 0.1}), force=True)
+
+    assert cq._alert_engine.fired == 1
+    assert "ALERT: Gemini 3 Flash" in capsys.readouterr().out
+
+
+def test_import_skips_malformed_dumps(workdir, capsys):
+    (workdir / "quota_raw_2026-01-01_080000.json").write_text('{"userStatus": null}', encoding="utf-8")
+    (workdir / "quota_raw_2026-01-01_090000.json").write_text(
+        json.dumps(_response({"Gemini 3 Flash": 0.5})), encoding="utf-8")
+
+    added = cq.import_raw_dumps(workers=1)
+
+    assert added == 1
+    assert "1 file lỗi" in capsys.readouterr().out
+
+
+def test_import_into_full_history_ignores_trimmed_entries(workdir, monkeypatch):
+    monkeypatch.setattr(cq, "MAX_HISTORY_ENTRIES", 3)
+    for frac in (1.0, 0.8, 0.6):
+        cq._clock.sleep(3600)
+        cq.save_to_history(_response({"Gemini 3 Flash": frac}))
+    before = (workdir / "quota_history.json").read_text(encoding="utf-8")
+
+    # Dump cũ hơn toàn bộ history → bị cắt ngay khi gộp
+    (workdir / "quota_raw_2025-12-01_000000.json").write_text(
+        json.dumps(_response({"Gemini 3 Flash": 0.2})), encoding="utf-8")
+
+    assert cq.import_raw_dumps(workers=1) == 0
+    assert (workdir / "quota_history.json").read_text(encoding="utf-8") == before
+
+
+def _cached_log(n):
+    return cq._change_log.render(n) if cq._change_log.is_current() else None
+
+
+def _rebuilt_log(n):
+    cache = cq.ChangeLogCache()
+    cache.rebuild(cq.load_history())
+    return cache.render(n)
+
+
+@pytest.fixture
+def change_log(workdir, monkeypatch):
+    monkeypatch.setattr(cq, "_change_log", cq.ChangeLogCache())
+    return cq._change_log
+
+
+def test_change_log_cache_matches_rebuild_across_trimming(change_log, monkeypatch, capsys):
+    import random
+
+    monkeypatch.setattr(cq, "MAX_HISTORY_ENTRIES", 6)
+    rng = random.Random(0)
+    labels = ["A", "B", "C"]
+    fracs = {label: 1.0 for label in labels}
+    credits = 500
+    cq.save_to_history(_response(fracs, credits))
+    cq.show_change_log(3)
+
+    for _ in range(40):
+        cq._clock.sleep(60)
+        label = rng.choice(labels)
+        fracs[label] = round(rng.choice([0.0, 0.2, 0.4, 0.6, 0.8, 1.0]), 1)
+        if rng.random() < 0.3:
+            credits -= 1
+        cq.save_to_history(_response(fracs, credits))
+        for n in (3, 50):
+            assert _cached_log(n) == _rebuilt_log(n)
+    assert len(cq.load_history()) == 6
+    assert change_log.first_seq > 0
+
+
+def test_change_log_cache_rebuilds_after_external_rewrite(change_log, workdir, capsys):
+    for frac in (1.0, 0.4):
+        cq.save_to_history(_response({"Gemini 3 Flash": frac}))
+        cq._clock.sleep(3600)
+    cq.show_change_log(20)
+    assert change_log.is_current()
+
+    missing = cq._clock.now() - timedelta(minutes=90)
+    name = f"quota_raw_{missing.strftime('%Y-%m-%d_%H%M%S')}.json"
+    (workdir / name).write_text(json.dumps(_response({"Gemini 3 Flash": 0.7})), encoding="utf-8")
+    assert cq.import_raw_dumps(workers=1) == 1
+    assert not change_log.is_current()
+
+    capsys.readouterr()
+    cq.show_change_log(20)
+    out = capsys.readouterr().out
+    assert out == _rebuilt_log(20) + "\n"
+    assert "100.0% → 70.0%" in out
+
+
+def test_change_log_cache_rerenders_only_changed_model(change_log, monkeypatch, capsys):
+    fracs = {"A": 1.0, "B": 1.0, "C": 1.0}
+    cq.save_to_history(_response(fracs))
+    fracs = {"A": 0.8, "B": 0.8, "C": 0.8}
+    cq._clock.sleep(60)
+    cq.save_to_history(_response(fracs))
+    cq.show_change_log(20)
+
+    rendered = []
+    original = cq._render_model_section
+
+    def spy(label, changes):
+        rendered.append(label)
+        return original(label, changes)
+
+    monkeypatch.setattr(cq, "_render_model_section", spy)
+    fracs["B"] = 0.6
+    cq._clock.sleep(60)
+    cq.save_to_history(_response(fracs))
+    cq.show_change_log(20)
+
+    assert rendered == ["B"]
+    assert _cached_log(20) == _rebuilt_log(20)
+
+
+def test_monitor_loop_fast_path_skips_history_on_identical_polls(workdir, monkeypatch):
+    same = _response({"Gemini 3 Flash": 1.0})
+    changed = _response({"Gemini 3 Flash": 0.8})
+    responses = iter([same, same, same, changed, changed])
+    stats_seen = []
+    saves = []
+
+    def fetch(now):
+        # stat của history file sau khi tick trước xử lý xong
+        stats_seen.append(cq._history_stat())
+        return next(responses)
+
+    original_save = cq.save_to_history
+
+    def spy_save(*args, **kwargs):
+        saves.append(kwargs.get("force", False))
+        return original_save(*args, **kwargs)
+
+    monkeypatch.setattr(cq, "save_to_history", spy_save)
+    stats = {"checks": 0, "changes": 0}
+    cq.monitor_loop(fetch, 30, stats, max_checks=5, save_raw=False)
+    stats_seen.append(cq._history_stat())
+
+    assert stats["checks"] == 5
+    assert (stats["fast_path"], stats["full_path"], stats["changes"]) == (3, 1, 1)
+    # Lần đầu (force) + 1 lần thay đổi thật
+    assert saves == [True, False]
+    # stats_seen[i] = trạng thái file sau tick i (tick 1 = lần đầu)
+    assert stats_seen[2] == stats_seen[1]  # tick 2: fast
+    assert stats_seen[3] == stats_seen[2]  # tick 3: fast
+    assert stats_seen[4] != stats_seen[3]  # tick 4: full, có thay đổi
+    assert stats_seen[5] == stats_seen[4]  # tick 5: fast
+    assert len(cq.load_history()) == 2
+
+
+def test_replay_refuses_to_overwrite_real_history(workdir):
+    cq.save_to_history(_response({"Gemini 3 Flash": 1.0}))
+    before = (workdir / "quota_history.json").read_text(encoding="utf-8")
+
+    with pytest.raises(ValueError):
+        cq.replay(cq.iter_synthetic_responses(), max_checks=2, history_file="./quota_history.json")
+    with pytest.raises(SystemExit):
+        cq.cmd_replay(["--out", "quota_history.json"])
+
+    assert (workdir / "quota_history.json").read_text(encoding="utf-8") == before